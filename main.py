@@ -2,39 +2,98 @@ from ibapi.client import EClient
 from ibapi.wrapper import EWrapper
 from ibapi.contract import Contract
 from ibapi.execution import ExecutionFilter
+import numpy as np
 import pandas as pd
-from datetime import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook, load_workbook
 import time
 import os
+import uuid
 import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+# Output columns, in the order they are written to the Excel file
+COLUMNS = (
+    'Account', 'Action', 'Date_Time', 'Quantity', 'Symbol',
+    'Security_Info', 'Currency', 'Price', 'Commission',
+    'Unrealized_PnL', 'Realized_PnL', 'Exchange'
+)
+NUMERIC_COLUMNS = ['Quantity', 'Price', 'Commission', 'Unrealized_PnL', 'Realized_PnL']
+
+# Fixed-width time format reported by TWS and the format written to the file
+EXEC_TIME_FORMAT = '%Y%m%d  %H:%M:%S'
+DATE_TIME_FORMAT = '%d.%m.%Y %H:%M:%S'
+EXPIRY_FORMAT = '%Y%m%d'
+
+OPTION_SEC_TYPES = ('OPT', 'FOP')
+OPTION_MULTIPLIER = 100
+
+# Order reference of trades placed by OptTrader, which get an unrealized P&L
+OPT_TRADER_REF = 'OptTrader'
+
+# TWS reports a missing realized P&L as the largest float
+MAX_FLOAT_SENTINEL = 1.7976931348623157e+308
+
+# Contract and execution fields collected in execDetails, one list per field;
+# numeric fields are kept in array('d') buffers instead of lists of floats
+RAW_COLUMNS = [
+    'execId', 'acctNumber', 'side', 'time', 'orderRef', 'symbol', 'secType',
+    'lastTradeDateOrContractMonth', 'right', 'currency', 'exchange'
+]
+RAW_NUMERIC_COLUMNS = ['shares', 'price', 'strike']
+
+MONTH_NAMES = np.array([
+    'JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
+    'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC'
+], dtype=object)
 
 class TradingApp(EWrapper, EClient):
     def __init__(self, client_id, port):
         EClient.__init__(self, self)
         self.client_id = client_id
         self.port = port
-        self.executions = []
+        self.cols = {col: [] for col in RAW_COLUMNS}
+        self.cols.update({col: array('d') for col in RAW_NUMERIC_COLUMNS})
         self.commission_report = {}
-        self.is_ready = False
+        self.executions_ended = threading.Event()
+        self.done = threading.Event()
         
     def execDetails(self, reqId, contract, execution):
-        super().execDetails(reqId, contract, execution)
-        self.executions.append({
-            'contract': contract,
-            'execution': execution
-        })
+        # Keep only the fields we need instead of the ibapi objects
+        c = self.cols
+        c['execId'].append(execution.execId)
+        c['acctNumber'].append(execution.acctNumber)
+        c['side'].append(execution.side)
+        c['time'].append(execution.time)
+        c['shares'].append(execution.shares)
+        c['price'].append(execution.price)
+        c['orderRef'].append(getattr(execution, 'orderRef', '') or '')
+        c['symbol'].append(contract.symbol)
+        c['secType'].append(contract.secType)
+        c['lastTradeDateOrContractMonth'].append(contract.lastTradeDateOrContractMonth)
+        c['strike'].append(contract.strike)
+        c['right'].append(contract.right)
+        c['currency'].append(contract.currency)
+        c['exchange'].append(contract.exchange)
     
     def execDetailsEnd(self, reqId):
-        super().execDetailsEnd(reqId)
-        self.is_ready = True
+        self.executions_ended.set()
+        self._check_done()
         
     def commissionReport(self, commreport):
-        super().commissionReport(commreport)
         self.commission_report[commreport.execId] = {
             'commission': commreport.commission,
             'currency': commreport.currency,
             'realizedPNL': commreport.realizedPNL
         }
+        self._check_done()
+    
+    def _check_done(self):
+        # Commission reports can arrive after execDetailsEnd, so wait for both
+        if self.executions_ended.is_set() and len(self.commission_report) >= len(self.cols['execId']):
+            self.done.set()
 
 def get_trade_data_from_connection(port, client_id):
     """Connect to a single TWS instance and get trade data"""
@@ -53,21 +112,20 @@ def get_trade_data_from_connection(port, client_id):
         
         if not app.isConnected():
             print(f"Failed to connect to TWS on port {port}")
-            return []
+            return {}
         
         # Request executions
         print(f"Fetching trade data from port {port}...")
         app.reqExecutions(1, ExecutionFilter())
         
-        # Wait for data to be received
+        # Wait for all executions and their commission reports
         max_wait = 10
-        waited = 0
-        while not app.is_ready and waited < max_wait:
-            time.sleep(0.5)
-            waited += 0.5
-        
-        # Additional time to ensure all data is received
-        time.sleep(1)
+        if not app.executions_ended.wait(timeout=max_wait):
+            print(f"Timed out waiting for trade data from port {port}, using what was received")
+        else:
+            # Some executions never get a commission report; give late ones a moment
+            commission_wait = 1
+            app.done.wait(timeout=commission_wait)
         
         trade_data = process_executions(app)
         
@@ -75,274 +133,364 @@ def get_trade_data_from_connection(port, client_id):
         
     except Exception as e:
         print(f"Error connecting to port {port}: {str(e)}")
-        return []
+        return {}
     finally:
         if app.isConnected():
             app.disconnect()
 
 def process_executions(app):
-    """Process execution data from app"""
-    trade_data = []
+    """Process execution columns collected by app into per-column lists"""
+    commission_report = app.commission_report
     
-    for exec_info in app.executions:
-        contract = exec_info['contract']
-        execution = exec_info['execution']
-        
-        # Get account number
-        account = execution.acctNumber
-        
-        # Determine action (BOT, SLD)
-        action = 'BOT' if execution.side == 'BOT' else 'SLD'
-        
-        # Get execution time and format as DD.MM.YYYY HH:MM:SS
-        try:
-            dt = datetime.strptime(execution.time, '%Y%m%d  %H:%M:%S')
-            exec_time = dt.strftime('%d.%m.%Y %H:%M:%S')
-        except Exception as e:
-            print(f"Error formatting date: {e}")
-            exec_time = execution.time
-        
-        # Get quantity
-        quantity = execution.shares
-        
-        # Get symbol and security type
-        symbol = contract.symbol
-        sec_type = contract.secType
-        
-        # Initialize fields
-        option_expiry = ''
-        option_strike = ''
-        option_right = ''
-        currency = contract.currency
-        price = execution.price
-        
-        if sec_type == 'STK':
-            security_info = 'STOCK'
-        elif sec_type == 'OPT' or sec_type == 'FOP':
-            expiry_date_str = contract.lastTradeDateOrContractMonth
-            year = int(expiry_date_str[:4])
-            month = int(expiry_date_str[4:6])
-            day = int(expiry_date_str[6:8])
-            month_names = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 
-                         'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
-            formatted_date = f"{month_names[month-1]}'{day:02d}'{str(year)[-2:]}"
-            
-            option_strike = contract.strike
-            option_right = 'CALL' if contract.right == 'C' else 'PUT'
-            security_info = f"{formatted_date} {option_strike} {option_right}"
-        
-        # Get commission and realized P&L
+    # The API thread may still be appending after a timeout, so copy every
+    # column up to the length of the shortest instead of keeping the live lists
+    n = min(len(values) for values in app.cols.values())
+    cols = {col: values[:n] for col, values in app.cols.items()}
+    
+    # Fields used as reported; the underscore columns are only needed while
+    # processing and are not written to the file
+    trade_data = {
+        'Account': cols['acctNumber'],
+        'Date_Time': cols['time'],
+        'Quantity': cols['shares'],
+        'Symbol': cols['symbol'],
+        'Currency': cols['currency'],
+        'Price': cols['price'],
+        'Commission': array('d'),
+        'Realized_PnL': array('d'),
+        'Exchange': cols['exchange'],
+        '_side': cols['side'],
+        '_order_ref': cols['orderRef'],
+        '_sec_type': cols['secType'],
+        '_expiry': cols['lastTradeDateOrContractMonth'],
+        '_strike': cols['strike'],
+        '_right': cols['right'],
+    }
+    
+    # Bound once so the loop below does not look up the append methods
+    append_commission = trade_data['Commission'].append
+    append_realized_pnl = trade_data['Realized_PnL'].append
+    
+    # Get commission and realized P&L
+    for exec_id in cols['execId']:
         commission_value = 0.0
-        realized_pnl_from_tws = None
-        if execution.execId in app.commission_report:
-            commission_value = app.commission_report[execution.execId]['commission']
-            realized_pnl_from_tws = app.commission_report[execution.execId].get('realizedPNL')
-
-        if price == 0 and commission_value == 0:
-            action = 'EXPIRED'
-
-        unrealized_pnl = ''
-        realized_pnl = ''
-        
-        order_ref = getattr(execution, 'orderRef', '')
-        
-        if 'OptTrader' in str(order_ref):
-            unrealized_pnl = (price * 100) - commission_value
-        
-        MAX_FLOAT_SENTINEL = 1.7976931348623157e+308
+        realized_pnl = np.nan
+        if exec_id in commission_report:
+            commission_value = commission_report[exec_id]['commission']
+            realized_pnl = commission_report[exec_id].get('realizedPNL', np.nan)
         
-        if realized_pnl_from_tws is not None:
-            if isinstance(realized_pnl_from_tws, float):
-                if abs(realized_pnl_from_tws) != MAX_FLOAT_SENTINEL:
-                    try:
-                        realized_pnl = float(realized_pnl_from_tws)
-                    except (ValueError, TypeError):
-                        realized_pnl = ''
-            else:
-                try:
-                    realized_pnl = float(realized_pnl_from_tws)
-                except (ValueError, TypeError):
-                    realized_pnl = ''
-            
-        trade_data.append({
-            'Account': account,
-            'Action': action,
-            'Date_Time': exec_time,
-            'Quantity': quantity,
-            'Symbol': symbol,
-            'Security_Info': security_info,
-            'Currency': currency,
-            'Price': price,
-            'Commission': commission_value,
-            'Unrealized_PnL': unrealized_pnl,
-            'Realized_PnL': realized_pnl if realized_pnl != '' else '',
-            'Exchange': contract.exchange
-        })
+        append_commission(commission_value)
+        append_realized_pnl(realized_pnl)
     
     return trade_data
 
-def mark_assigned_options(trade_data):
+def format_security_info(df):
+    """Build Security_Info: STOCK for stocks, "MON'DD'YY strike CALL/PUT" for options"""
+    is_option = df['_sec_type'].isin(OPTION_SEC_TYPES)
+    
+    # Only full YYYYMMDD dates are parsed; to_datetime would also accept
+    # e.g. a contract month '202412' as 2024-01-02
+    is_full_date = is_option & df['_expiry'].astype(str).str.fullmatch(r'\d{8}', na=False)
+    expiry = pd.to_datetime(df['_expiry'].where(is_full_date), format=EXPIRY_FORMAT, errors='coerce')
+    has_expiry = expiry.notna()
+    
+    # Expiries that are not a full date are kept as reported
+    option_expiry = df['_expiry'].astype(object).where(is_option, '')
+    if has_expiry.any():
+        parsed = expiry[has_expiry]
+        months = pd.Series(MONTH_NAMES[parsed.dt.month.to_numpy() - 1], index=parsed.index)
+        option_expiry[has_expiry] = months + parsed.dt.strftime("'%d'%y").astype(object)
+    option_right = np.where(df['_right'] == 'C', 'CALL', 'PUT')
+    
+    option_info = option_expiry + ' ' + df['_strike'].astype(str) + ' ' + option_right
+    df['Security_Info'] = np.where(df['_sec_type'] == 'STK', 'STOCK', option_info.where(is_option, ''))
+    
+    # Combos use the formatted expiry and need no strike for non-option legs
+    df['_expiry'] = option_expiry
+    df['_strike'] = df['_strike'].where(is_option)
+    
+    return df
+
+def parse_execution_times(df):
+    """Parse raw TWS execution times and format Date_Time as DD.MM.YYYY HH:MM:SS"""
+    exec_time = pd.to_datetime(df['Date_Time'], format=EXEC_TIME_FORMAT, errors='coerce')
+    
+    invalid = exec_time.isna()
+    if invalid.any():
+        print(f"Error formatting date: {df.loc[invalid, 'Date_Time'].tolist()}")
+    
+    # Unparseable times are kept as received; the parsed column is used for grouping
+    df['Date_Time'] = exec_time.dt.strftime(DATE_TIME_FORMAT).where(~invalid, df['Date_Time'])
+    df['_exec_time'] = exec_time
+    
+    return df
+
+def assign_actions(df):
+    """Set Action to BOT or SLD, or EXPIRED for trades with no price and no commission"""
+    action = np.where(df['_side'].to_numpy() == 'BOT', 'BOT', 'SLD').astype(object)
+    action[(df['Price'].to_numpy() == 0) & (df['Commission'].to_numpy() == 0)] = 'EXPIRED'
+    df['Action'] = action
+    
+    return df
+
+def clean_realized_pnl(df):
+    """Replace the TWS max-float placeholder in Realized_PnL with NaN"""
+    realized_pnl = df['Realized_PnL'].to_numpy(dtype=np.float64)
+    df['Realized_PnL'] = np.where(np.abs(realized_pnl) == MAX_FLOAT_SENTINEL, np.nan, realized_pnl)
+    
+    return df
+
+def compute_unrealized_pnl(df):
+    """Set Unrealized_PnL for OptTrader trades; empty for all others"""
+    is_opt_trader = df['_order_ref'].str.contains(OPT_TRADER_REF, regex=False, na=False)
+    unrealized_pnl = df['Price'] * OPTION_MULTIPLIER - df['Commission']
+    df['Unrealized_PnL'] = np.where(is_opt_trader, unrealized_pnl, np.nan)
+    
+    return df
+
+def mark_assigned_options(df):
     """Mark options as ASSIGNED if they match stock trades with same symbol and datetime"""
-    stock_trades = {}
-    
-    for trade in trade_data:
-        if trade['Security_Info'] == 'STOCK':
-            key = (trade['Symbol'], trade['Date_Time'])
-            if key not in stock_trades:
-                stock_trades[key] = []
-            stock_trades[key].append(trade)
-    
-    for trade in trade_data:
-        if trade['Security_Info'] != 'STOCK' and trade['Price'] == 0 and trade['Commission'] == 0:
-            key = (trade['Symbol'], trade['Date_Time'])
-            if key in stock_trades:
-                trade['Action'] = 'ASSIGNED'
-            else:
-                if trade['Action'] not in ['ASSIGNED', 'BOT', 'SLD']:
-                    trade['Action'] = 'EXPIRED'
+    is_stock = df['Security_Info'] == 'STOCK'
+    stock_keys = pd.MultiIndex.from_frame(df.loc[is_stock, ['Symbol', 'Date_Time']])
+    trade_keys = pd.MultiIndex.from_frame(df[['Symbol', 'Date_Time']])
+    matches_stock = trade_keys.isin(stock_keys)
     
-    return trade_data
+    is_zero_option = ~is_stock & (df['Price'] == 0) & (df['Commission'] == 0)
+    
+    df.loc[is_zero_option & matches_stock, 'Action'] = 'ASSIGNED'
+    unmatched = is_zero_option & ~matches_stock & ~df['Action'].isin(('ASSIGNED', 'BOT', 'SLD'))
+    df.loc[unmatched, 'Action'] = 'EXPIRED'
+    
+    return df
+
+def _combo_security_info(legs, leg_group_id):
+    """Build the combined label (expiry and two highest strikes) for each combo group"""
+    group_ids = leg_group_id.to_numpy()
+    strikes = legs['_strike'].to_numpy()
+    
+    # One stable sort by group, then strike: each group's legs end up
+    # together, lowest strike first
+    order = np.lexsort((strikes, group_ids))
+    group_ids = group_ids[order]
+    strikes = strikes[order]
+    
+    first = np.flatnonzero(np.r_[True, group_ids[1:] != group_ids[:-1]])
+    last = np.r_[first[1:], len(group_ids)] - 1
+    second = np.maximum(last - 1, first)
+    
+    expiry_date = legs['_expiry'].to_numpy()[order][first]
+    highest = pd.Series(strikes[last]).astype(int).astype(str)
+    second_highest = pd.Series(strikes[second]).astype(int).astype(str)
+    strike_str = highest.where(last == first, highest + '/' + second_highest)
+    
+    labels = (pd.Series(expiry_date, dtype=object) + ' ' + strike_str).where(expiry_date != '', '')
+    labels.index = group_ids[first]
+    
+    return labels
 
-def process_combos(trade_data):
+def process_combos(df):
     """Process combo trades"""
-    from collections import defaultdict
+    # Trades with the same symbol and execution time form one group
+    group_id = df.groupby(['Symbol', '_exec_time'], sort=False).ngroup()
+    group_id = group_id.where(df['_exec_time'].notna())
     
-    trade_groups = defaultdict(list)
-    stocks_trades = []
-    parse_error_trades = []
+    gid = group_id.to_numpy()
     
-    for trade in trade_data:
-        if trade['Security_Info'] == 'STOCKS':
-            stocks_trades.append(trade)
-            continue
-            
-        try:
-            trade_time = datetime.strptime(trade['Date_Time'], '%d.%m.%Y %H:%M:%S')
-            time_key = (trade['Symbol'], trade_time.strftime('%d.%m.%Y %H:%M:%S'))
-            trade_groups[time_key].append(trade)
-        except Exception as e:
-            parse_error_trades.append(trade)
-    
-    processed_trades = []
-    for (symbol, time_str), trades in trade_groups.items():
-        if len(trades) <= 1:
-            for trade in trades:
-                processed_trades.append(trade)
-            continue
+    is_smart = df['Exchange'].to_numpy() == 'SMART'
+    has_negative = (df.groupby(group_id)['Price'].transform('min') < 0).to_numpy()
+    
+    # Combos are only merged when every non-SMART leg is an option
+    is_leg = has_negative & ~is_smart
+    bad_groups = np.unique(gid[is_leg & df['_strike'].isna().to_numpy()])
+    is_combo = has_negative & ~np.isin(gid, bad_groups)
+    
+    # Combo groups that were also reported as a single row on SMART
+    smart_rows = is_combo & is_smart
+    has_smart = np.isin(gid, np.unique(gid[smart_rows]))
+    
+    legs = df[is_combo & ~is_smart]
+    
+    if not legs.empty and smart_rows.any():
+        labels = _combo_security_info(legs, group_id[legs.index])
+        pnl_sums = legs['Realized_PnL'].groupby(group_id[legs.index]).sum()
         
-        has_negative = any(trade['Price'] < 0 for trade in trades)
+        smart_group_id = group_id[smart_rows]
         
-        if has_negative:
-            non_smart_trades = [t for t in trades if t.get('Exchange') != 'SMART']
-            
-            try:
-                sorted_trades = sorted(non_smart_trades, key=lambda x: float(x['Security_Info'].split()[1])) if non_smart_trades else []
-                strikes = [float(trade['Security_Info'].split()[1]) for trade in sorted_trades]
-                types = [trade['Security_Info'].split()[2] for trade in sorted_trades]
-                expiry_date = sorted_trades[0]['Security_Info'].split()[0] if sorted_trades else ''
-                
-                if strikes and expiry_date:
-                    first_two_strikes = [str(int(s)) for s in sorted(strikes, reverse=True)[:2]]
-                    strike_str = '/'.join(first_two_strikes)
-                    combined_security_info = f"{expiry_date} {strike_str}"
-                else:
-                    combined_security_info = ''
-                
-                pnl_sum = 0.0
-                for trade in non_smart_trades:
-                    if trade.get('Realized_PnL') and trade['Realized_PnL'] != '':
-                        try:
-                            pnl_sum += float(trade['Realized_PnL'])
-                        except (ValueError, TypeError):
-                            pass
-                
-                for trade in trades:
-                    if trade.get('Exchange') == 'SMART':
-                        if combined_security_info:
-                            trade['Security_Info'] = combined_security_info
-                        if pnl_sum != 0:
-                            current_pnl = trade.get('Realized_PnL', '')
-                            if current_pnl and current_pnl != '':
-                                try:
-                                    trade['Realized_PnL'] = float(current_pnl) + pnl_sum
-                                except (ValueError, TypeError):
-                                    trade['Realized_PnL'] = pnl_sum
-                            else:
-                                trade['Realized_PnL'] = pnl_sum
-                        processed_trades.append(trade)
-                
-                if not any(t.get('Exchange') == 'SMART' for t in trades):
-                    for trade in trades:
-                        processed_trades.append(trade)
-                        
-            except (IndexError, ValueError) as e:
-                for trade in trades:
-                    processed_trades.append(trade)
-        else:
-            for trade in trades:
-                processed_trades.append(trade)
+        combined_security_info = smart_group_id.map(labels).fillna('')
+        combined_security_info = combined_security_info[combined_security_info != '']
+        df.loc[combined_security_info.index, 'Security_Info'] = combined_security_info
+        
+        pnl_sum = smart_group_id.map(pnl_sums).fillna(0.0)
+        pnl_sum = pnl_sum[pnl_sum != 0]
+        current_pnl = df.loc[pnl_sum.index, 'Realized_PnL'].fillna(0.0)
+        df.loc[pnl_sum.index, 'Realized_PnL'] = current_pnl + pnl_sum
     
-    processed_trades.extend(stocks_trades)
-    processed_trades.extend(parse_error_trades)
+    # Legs of a combo that was also reported on SMART are folded into that row
+    keep = ~(is_combo & ~is_smart & has_smart)
     
-    return processed_trades
+    # Keep each group together in order of first appearance, unparseable times last
+    order = np.argsort(np.nan_to_num(gid, nan=np.inf), kind='stable')
+    
+    return df.iloc[order[keep[order]]].reset_index(drop=True)
 
-def save_to_excel(data, filepath):
-    """Save trade data to Excel file"""
-    if not data:
-        print("No trade data to save.")
-        return
+def _excel_rows(df):
+    """Rows of df as tuples, with None (an empty cell) in place of NaN"""
+    df = df.astype(object)
+    return df.where(df.notna(), None).itertuples(index=False)
+
+def write_excel(df, filepath):
+    """Write rows to a new Excel file, streaming them to disk"""
+    # write_only keeps memory bounded, since rows are not held in the sheet
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Sheet1')
+    
+    ws.append(list(df.columns))
+    for row in _excel_rows(df):
+        ws.append(row)
     
-    data = mark_assigned_options(data)
-    processed_data = process_combos(data)
+    wb.save(filepath)
+
+def build_trade_frame(data):
+    """Build the output DataFrame from the collected per-column trade data"""
+    # Build from columns directly instead of a list of row dicts;
+    # numeric array('d') buffers are wrapped without copying
+    df = pd.DataFrame({
+        col: np.frombuffer(values, dtype=np.float64) if isinstance(values, array) else values
+        for col, values in data.items()
+    }, copy=False)
     
-    df = pd.DataFrame(processed_data)
+    df = parse_execution_times(df)
+    df = format_security_info(df)
+    df = assign_actions(df)
+    df = clean_realized_pnl(df)
+    df = compute_unrealized_pnl(df)
+    df = mark_assigned_options(df)
+    df = process_combos(df)
     
-    columns = [
-        'Account', 'Action', 'Date_Time', 'Quantity', 'Symbol',
-        'Security_Info', 'Currency', 'Price', 'Commission',
-        'Unrealized_PnL', 'Realized_PnL', 'Exchange'
-    ]
+    # Output columns in file order; drops the internal underscore columns
+    return df.reindex(columns=COLUMNS)
+
+def save_to_parquet(df, dataset_dir):
+    """Save trade data as a new zstd-compressed file in a Parquet dataset directory"""
+    if df.empty:
+        print("No trade data to save.")
+        return
     
-    columns = [col for col in columns if col in df.columns]
-    df = df[columns]
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        
+        # Only the new rows are written; UTC timestamped names keep files in run order
+        now_ns = time.time_ns()
+        timestamp = time.strftime('%Y%m%d-%H%M%S', time.gmtime(now_ns // 10**9))
+        run_id = f"{timestamp}.{now_ns % 10**9:09d}-{uuid.uuid4().hex}"
+        pq.write_to_dataset(
+            table,
+            root_path=dataset_dir,
+            compression='zstd',
+            basename_template=f"trades-{run_id}-{{i}}.parquet"
+        )
+        print(f"Saved {len(df)} records to {dataset_dir}")
+    except Exception as e:
+        print(f"Error saving to Parquet: {str(e)}")
+
+def _has_parquet_files(dataset_dir):
+    """Whether the Parquet dataset directory already holds any data files"""
+    return os.path.isdir(dataset_dir) and any(
+        name.endswith('.parquet') for name in os.listdir(dataset_dir)
+    )
+
+def _excel_row_count(filepath):
+    """Number of data rows (header excluded) in the first sheet of an Excel file"""
+    wb = load_workbook(filepath, read_only=True)
+    try:
+        ws = wb.active
+        max_row = ws.max_row
+        if max_row is None:
+            max_row = sum(1 for _ in ws.iter_rows(values_only=True))
+        return max(max_row - 1, 0)
+    finally:
+        wb.close()
+
+def import_excel_history(filepath, dataset_dir):
+    """Copy an existing Excel trade history into a new, empty Parquet dataset"""
+    if _has_parquet_files(dataset_dir) or not os.path.exists(filepath):
+        return
     
     try:
-        if os.path.exists(filepath):
-            existing_df = pd.read_excel(filepath)
-            df = pd.concat([existing_df, df], ignore_index=True)
-            print(f"Appending {len(processed_data)} new records to existing file...")
-        else:
-            print(f"Creating new file with {len(processed_data)} records...")
+        df = pd.read_excel(filepath).reindex(columns=COLUMNS)
+        if df.empty:
+            return
         
-        df.to_excel(filepath, index=False)
-        print(f"Data successfully saved to {filepath}")
+        # Same column types as newly fetched trades, so the dataset files match;
+        # text columns stay text even when the workbook has them all empty
+        text_columns = [col for col in COLUMNS if col not in NUMERIC_COLUMNS]
+        df[NUMERIC_COLUMNS] = df[NUMERIC_COLUMNS].astype(np.float64)
+        df[text_columns] = df[text_columns].astype('string')
+        print(f"Importing {len(df)} existing records from {filepath}...")
+        save_to_parquet(df, dataset_dir)
     except Exception as e:
-        print(f"Error saving to Excel: {str(e)}")
+        print(f"Error importing Excel history: {str(e)}")
+
+def export_to_excel(dataset_dir, filepath):
+    """Write all trades in the Parquet dataset to an Excel file, replacing it"""
+    try:
+        df = pd.read_parquet(dataset_dir)
+        
+        # Never replace a workbook holding history the dataset does not have
+        if os.path.exists(filepath) and _excel_row_count(filepath) > len(df):
+            print(f"Not exporting to {filepath}: it has more records than {dataset_dir}")
+            return
+        
+        print(f"Exporting {len(df)} records to {filepath}...")
+        write_excel(df, filepath)
+        print(f"Data successfully exported to {filepath}")
+    except Exception as e:
+        print(f"Error exporting to Excel: {str(e)}")
 
 def main():
     # List of TWS ports to connect to
     # Change these ports according to your TWS settings
     ports = ["YOUR PORT"]  # Example: [3714, 7297, 5468] for 3 different accounts
     
-    all_trade_data = []
+    all_trade_data = {}
+    
+    # Connect to all ports at once; each connection mostly waits on TWS
+    with ThreadPoolExecutor(max_workers=max(1, len(ports))) as executor:
+        futures = [
+            executor.submit(get_trade_data_from_connection, port, i + 1)
+            for i, port in enumerate(ports)
+        ]
     
-    # Connect to all ports and collect data
-    for i, port in enumerate(ports):
+    # Collect results in port order
+    for port, future in zip(ports, futures):
         try:
-            trade_data = get_trade_data_from_connection(port, i + 1)
-            if trade_data:
-                all_trade_data.extend(trade_data)
-                print(f"Successfully retrieved {len(trade_data)} trades from port {port}")
+            trade_data = future.result()
+            if trade_data and trade_data['Account']:
+                # values[:0] starts each column as an empty list or array('d')
+                for col, values in trade_data.items():
+                    all_trade_data.setdefault(col, values[:0]).extend(values)
+                print(f"Successfully retrieved {len(trade_data['Account'])} trades from port {port}")
             else:
                 print(f"No trades found on port {port}")
         except Exception as e:
             print(f"Error processing port {port}: {str(e)}")
     
     if all_trade_data:
-        output_file = r"YOUR FILE PATH\trade_data.xlsx"  # Change to your desired output path
-        save_to_excel(all_trade_data, output_file)
-        print(f"\nTotal trades exported: {len(all_trade_data)}")
+        df = build_trade_frame(all_trade_data)
+        
+        # Trades are stored in a Parquet dataset; the Excel file is a view
+        # exported from the whole dataset
+        dataset_dir = r"YOUR FOLDER PATH\trade_data"  # Change to your desired dataset folder
+        excel_file = r"YOUR FILE PATH\trade_data.xlsx"  # Change to your desired output path, or None to skip Excel
+        
+        # On the first run, carry over the history from an existing Excel file
+        if excel_file:
+            import_excel_history(excel_file, dataset_dir)
+        
+        save_to_parquet(df, dataset_dir)
+        if excel_file:
+            export_to_excel(dataset_dir, excel_file)
+        print(f"\nTotal trades exported: {len(all_trade_data['Account'])}")
     else:
         print("\nNo trade data collected from any account.")
 